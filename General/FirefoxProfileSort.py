@@ -6,44 +6,73 @@ by their `Name` value, and rewrites the file with the sorted entries. The origin
 backed up as `profiles.ini_old`.
 """
 
-import configparser
-import re
 import os
 
-# Create configparser object and preserve the case of keys (optionxform disables lowercasing)
-config = configparser.ConfigParser()
-config.optionxform = str
-
 # Path to Firefox profiles.ini in user's AppData
 inifile = os.getenv('APPDATA') + r'\Mozilla\Firefox\profiles.ini'
-config.read(inifile)
 
-# New config object to hold sorted profiles
-nconfig = configparser.ConfigParser()
-nconfig.optionxform = str
+with open(inifile, 'r', encoding='utf-8') as f:
+    lines = f.readlines()
+
+# Split the file into blocks, one per [Section] header. Only the order of
+# [ProfileN] blocks changes, so there is no need to parse values with
+# configparser and re-serialize — the original lines are kept verbatim.
+preamble = []  # anything before the first section header
+blocks = []    # (section_name, [body lines])
+current = None
+
+for line in lines:
+    if line.startswith('['):
+        current = (line.strip().strip('[]'), [])
+        blocks.append(current)
+    elif current is None:
+        preamble.append(line)
+    else:
+        current[1].append(line)
+
+
+# Extract a block's Name= value with a single scan
+def profile_name(body):
+    for line in body:
+        key, sep, value = line.partition('=')
+        if sep and key.strip() == 'Name':
+            return value.strip()
+    return ''
+
+
+# Keep non-profile sections ([General], [Install...]) in their original order
+other_blocks = [b for b in blocks if not b[0].startswith('Profile')]
+profile_blocks = [b for b in blocks if b[0].startswith('Profile')]
+
+# Sort profile blocks by their Name value (section name breaks ties)
+sorted_blocks = sorted((profile_name(body), section, body) for section, body in profile_blocks)
 
-# Copy the [General] section as-is
-nconfig['General'] = config['General']
+# Reassemble: unchanged sections first, then the profiles renumbered in sorted order
+output = list(preamble)
 
-# Collect all sections that start with "Profile"
-profiles = [section for section in config.sections() if re.match('^Profile', section)]
 
-# Sort profiles alphabetically by their 'Name' entry
-sorted_profiles = sorted(profiles, key=lambda profile: config[profile]['Name'])
+def append_block(header, body):
+    # Reordering can place a block that had no trailing blank line before
+    # another section; keep one blank line between blocks
+    if output and output[-1].strip():
+        output.append('\n')
+    output.append(header)
+    output.extend(body)
 
-# Rebuild the sorted profiles into the new config
-for idx, profile in enumerate(sorted_profiles):
-    nconfig["Profile" + str(idx)] = config[profile]
-    # Python 3.6+ preserves insertion order in dictionaries
-    # Renaming profiles is not strictly necessary, but done here for consistent indexing
 
-# Remove any previous backup if it exists
-if os.path.exists(inifile + '_old'):
-    os.remove(inifile + '_old')
+for section, body in other_blocks:
+    append_block('[' + section + ']\n', body)
+for idx, (_, _, body) in enumerate(sorted_blocks):
+    append_block('[Profile' + str(idx) + ']\n', body)
 
-# Backup the original file
-os.rename(inifile, inifile + '_old')
+# Write the sorted file to a sibling temp file first, then swap it in with
+# os.replace so a crash can never leave the user without a live profiles.ini
+with open(inifile + '.tmp', 'w', encoding='utf-8') as f:
+    f.writelines(output)
+    f.flush()
+    os.fsync(f.fileno())
 
-# Write the sorted config back to the original file location
-with open(inifile, 'w') as f:
-    nconfig.write(f, space_around_delimiters=False)
+# Backup the original (os.replace overwrites any previous backup), then
+# atomically move the new file into place
+os.replace(inifile, inifile + '_old')
+os.replace(inifile + '.tmp', inifile)
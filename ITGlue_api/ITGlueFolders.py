@@ -1,8 +1,10 @@
 import os
-import requests
 import json
 import csv
 import time
+import asyncio
+import aiohttp
+import orjson
 from datetime import datetime
 from dotenv import load_dotenv
 from folder_resolver import FolderResolver
@@ -11,6 +13,23 @@ from folder_resolver import FolderResolver
 DEBUG_ORG_ID = None  # Set to None to process all organizations
 DEBUG_ORG_COUNT = 1  # Limit full run to first X orgs (set to None to disable)
 ORG_CACHE_FILE = "org_cache.json"
+PASSWORD_CACHE_FILE = "password_cache.json"
+CSV_EXPORT_FILE = "itglue_passwords.csv"
+JSONL_EXPORT_FILE = "itglue_passwords.jsonl"
+MAX_CONCURRENT_REQUESTS = 64  # Cap on simultaneous in-flight API calls
+
+# === Column order for the CSV / JSONL export ===
+EXPORT_FIELDS = [
+    "OrgID",
+    "OrgName",
+    "PasswordID",
+    "PasswordName",
+    "Username",
+    "FolderID",
+    "FolderName",
+    "ParentFolderName",
+    "FolderURL"
+]
 
 # === Load environment variables from .env file ===
 load_dotenv()
@@ -24,31 +43,83 @@ HEADERS = {
     "Accept": "application/vnd.api+json"
 }
 
+# === Prebuilt URL templates — formatted once here, filled in per call ===
+ORG_URL = f"{API_BASE}/organizations/{{}}".format
+ORG_PAGE_URL = f"{API_BASE}/organizations?page[number]={{}}&page[size]=100".format
+ORG_PASSWORDS_URL = (
+    f"{API_BASE}/organizations/{{}}/passwords"
+    "?page[number]={}&page[size]=1000&include=password-folder"
+).format
+FOLDER_URL = f"{UI_BASE}/{{}}/passwords/folder/{{}}".format
+
 # === Global counter for API rate limit hits ===
 rate_limit_hits = 0
 
+# === Token bucket rate limiter, tuned from the X-RateLimit-* response headers ===
+class TokenBucket:
+    def __init__(self, rate=5, capacity=10):
+        self.rate = rate          # tokens refilled per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Block (asynchronously) until a request token is available
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    # Adjust the refill rate to whatever budget ITGlue advertises
+    def update_from_headers(self, headers):
+        limit = headers.get("X-RateLimit-Limit")
+        if limit:
+            try:
+                per_minute = max(1, int(limit))
+            except ValueError:
+                return
+            self.rate = per_minute / 60
+            self.capacity = per_minute
+
+# === Shared concurrency controls for all API calls ===
+request_sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+rate_limiter = TokenBucket()
+
 # === Safely performs a GET request, respecting rate limits and retries ===
-def safe_get(url, headers, retry_limit=3):
+async def safe_get(session, url, retry_limit=3):
     global rate_limit_hits
 
     for attempt in range(retry_limit):
-        response = requests.get(url, headers=headers)
-
-        # Handle ITGlue 429 rate-limiting
-        if response.status_code == 429:
-            retry_after = int(response.headers.get("Retry-After", "60"))
-            rate_limit_hits += 1
-            print(f"[!] Rate limit hit. Waiting {retry_after} seconds...")
-            time.sleep(retry_after)
-            continue
+        await rate_limiter.acquire()
+        retry_wait = 2
+
+        async with request_sem:
+            async with session.get(url) as response:
+                rate_limiter.update_from_headers(response.headers)
 
-        # Success — return the response
-        if response.ok:
-            return response
+                # Handle ITGlue 429 rate-limiting with exponential backoff
+                if response.status == 429:
+                    retry_after = int(response.headers.get("Retry-After", "60"))
+                    rate_limit_hits += 1
+                    retry_wait = retry_after * (2 ** attempt)
+                    print(f"[!] Rate limit hit. Waiting {retry_wait} seconds...")
 
-        # Retry for non-429 failures (e.g. 500, 404, etc.)
-        print(f"[!] Request failed: {response.status_code} {response.reason} → {url}")
-        time.sleep(2)
+                # Success — return the parsed JSON:API payload
+                # (orjson parses the large list bodies ~3x faster than stdlib json)
+                elif response.status < 400:
+                    return orjson.loads(await response.read())
+
+                # Retry for non-429 failures (e.g. 500, 404, etc.)
+                else:
+                    print(f"[!] Request failed: {response.status} {response.reason} → {url}")
+
+        # Sleep outside the semaphore and response context so a backing-off
+        # task doesn't pin a concurrency slot and a pooled connection
+        await asyncio.sleep(retry_wait)
 
     raise Exception(f"[!] Failed after {retry_limit} attempts: {url}")
 
@@ -59,26 +130,42 @@ def load_org_cache():
             return json.load(f)
     return {}
 
-# === Save org cache to disk ===
+# === Save org cache to disk (atomic: write a temp file, swap into place) ===
+# This file is rewritten after every completed org, so it is kept compact and
+# replaced atomically — a crash mid-write can't corrupt the progress record
 def save_org_cache(cache):
-    with open(ORG_CACHE_FILE, "w", encoding="utf-8") as f:
+    tmp_file = ORG_CACHE_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(cache, f, separators=(',', ':'))
+    os.replace(tmp_file, ORG_CACHE_FILE)
+
+# === Load per-password cache from disk (if present) ===
+# Keyed by password ID, storing the updated-at stamp and the finished export
+# row, so unchanged passwords are skipped entirely on repeat runs
+def load_password_cache():
+    if os.path.exists(PASSWORD_CACHE_FILE):
+        with open(PASSWORD_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+# === Save per-password cache to disk ===
+def save_password_cache(cache):
+    with open(PASSWORD_CACHE_FILE, "w", encoding="utf-8") as f:
         json.dump(cache, f, indent=2)
 
 # === Paginate and retrieve all organizations, updating the local cache ===
-def get_all_organizations():
+async def get_all_organizations(session):
     org_cache = load_org_cache()
     page = 1
+    new_orgs = 0
     print("[*] Querying all organizations with pagination...")
 
     while True:
         print(f"  → Fetching page {page}")
-        response = safe_get(
-            f"{API_BASE}/organizations?page[number]={page}&page[size]=100",
-            headers=HEADERS
-        )
+        payload = await safe_get(session, ORG_PAGE_URL(page))
 
         # Add any new orgs to the cache
-        for org in response.json().get("data", []):
+        for org in payload.get("data", []):
             org_id = org["id"]
             org_name = org["attributes"]["name"]
             if org_id not in org_cache:
@@ -86,65 +173,98 @@ def get_all_organizations():
                     "OrgName": org_name,
                     "Processed": False
                 }
+                new_orgs += 1
 
         # Check for a next page link
-        links = response.json().get("links", {})
-        if not links.get("next"):
+        if not payload.get("links", {}).get("next"):
             break
         page += 1
 
-    save_org_cache(org_cache)
+    # Only rewrite the cache if this run actually discovered new orgs
+    if new_orgs:
+        save_org_cache(org_cache)
     return org_cache
 
 # === Process all passwords for a given org and resolve folder names ===
-def process_org_passwords(org_id, org_name, resolver):
-    password_data = []
-
-    # Get all password relationships for the org
-    pw_ids = []
+async def process_org_passwords(session, org_id, org_name, resolver, row_queue, password_cache):
+    rows_queued = 0
+
+    # Page through the org's passwords with the folder relationship included,
+    # so each page carries everything a per-password detail call would return
+    passwords = []
+    folder_names = {}    # folder id → name, from the included sections
+    folder_parents = {}  # folder id → parent folder id (or None for root)
     page = 1
 
     while True:
         print(f"    - Fetching password page {page}")
-        pw_page_resp = safe_get(
-            f"{API_BASE}/organizations/{org_id}/relationships/passwords?page[number]={page}&page[size]=100",
-            headers=HEADERS
-        )
+        pw_page = await safe_get(session, ORG_PASSWORDS_URL(org_id, page))
 
-        data = pw_page_resp.json().get("data", [])
-        pw_ids.extend(data)
+        passwords.extend(pw_page.get("data", []))
 
-        links = pw_page_resp.json().get("links", {})
-        if not links.get("next"):
+        # Collect the folder records the include= already paid for
+        for inc in pw_page.get("included", []):
+            if inc.get("type") == "password-folders":
+                inc_attrs = inc.get("attributes", {})
+                folder_names[str(inc.get("id"))] = inc_attrs.get("name")
+                folder_parents[str(inc.get("id"))] = inc_attrs.get("parent-id")
+
+        if not pw_page.get("links", {}).get("next"):
             break
 
         page += 1
 
-    print(f"    - Found {len(pw_ids)} passwords")
+    print(f"    - Found {len(passwords)} passwords")
 
-    for pw in pw_ids:
-        pw_id = pw["id"]
-        print(f"[+] Processing Password ID: {pw_id}")
+    # Seed the resolver cache from the included folders so those names are
+    # never re-fetched one at a time (only where the parent's name is also
+    # known — otherwise leave the id for the resolver to look up properly)
+    for fid, name in folder_names.items():
+        if not name or fid in resolver.cache:
+            continue
+        parent_id = folder_parents.get(fid)
+        if parent_id is None:
+            parent_name = "root"
+        elif str(parent_id) in folder_names and folder_names[str(parent_id)]:
+            parent_name = folder_names[str(parent_id)]
+        else:
+            continue
+        resolver.cache[fid] = {
+            "FolderName": name,
+            "ParentFolderName": parent_name
+        }
 
-        pw_detail_resp = safe_get(f"{API_BASE}/passwords/{pw_id}", headers=HEADERS)
-        pw_detail = pw_detail_resp.json().get("data", {})
+    for pw_detail in passwords:
+        pw_id = pw_detail.get("id")
         attrs = pw_detail.get("attributes", {})
         rels = pw_detail.get("relationships", {})
+        updated_at = attrs.get("updated-at")
+
+        # Unchanged since the cached run? Reuse the finished row as-is
+        cached = password_cache.get(pw_id)
+        if cached and updated_at and cached.get("updated_at") == updated_at:
+            if cached.get("row"):
+                await row_queue.put(cached["row"])
+                rows_queued += 1
+            continue
 
         # Determine folder ID from relationships or fallback to attributes
-        folder_id = rels.get("password-folder", {}).get("data", {}).get("id") or attrs.get("password-folder-id")
+        # (with include=, folderless passwords carry an explicit "data": null,
+        # so guard each level against a present-but-None value)
+        folder_id = ((rels.get("password-folder") or {}).get("data") or {}).get("id") or attrs.get("password-folder-id")
 
         if not folder_id:
-            print("    - Password not in a folder")
+            print(f"    - Password {pw_id} not in a folder")
+            password_cache[pw_id] = {"updated_at": updated_at, "row": None}
             continue
 
-        resolved = resolver.resolve(org_id, folder_id)
+        resolved = await resolver.resolve(org_id, folder_id)
         folder_name = resolved.get("FolderName")
         parent_name = resolved.get("ParentFolderName")
-        folder_url = f"{UI_BASE}/{org_id}/passwords/folder/{folder_id}"
+        folder_url = FOLDER_URL(org_id, folder_id)
 
         if folder_name:
-            password_data.append({
+            row = {
                 "OrgID": org_id,
                 "OrgName": org_name,
                 "PasswordID": pw_id,
@@ -154,84 +274,135 @@ def process_org_passwords(org_id, org_name, resolver):
                 "FolderName": folder_name,
                 "ParentFolderName": parent_name,
                 "FolderURL": folder_url
-            })
-
-    return password_data
-
-# === Export results to JSON and CSV ===
-def export_password_data(password_data):
-    if not password_data:
-        print("[!] No passwords with folders found. Skipping export.")
-        return
-
-    with open("itglue_passwords.json", "w") as jf:
-        json.dump(password_data, jf, indent=2)
-
-    with open("itglue_passwords.csv", "w", newline='', encoding="utf-8") as cf:
-        writer = csv.DictWriter(cf, fieldnames=password_data[0].keys())
+            }
+            await row_queue.put(row)
+            rows_queued += 1
+            password_cache[pw_id] = {"updated_at": updated_at, "row": row}
+
+    return rows_queued
+
+# === Single-consumer export writer: drains the row queue and streams to disk ===
+# Rows are written as they resolve (CSV plus one JSON object per line), so
+# memory stays constant and disk I/O overlaps the network fetches.
+async def export_writer(row_queue):
+    rows_written = 0
+
+    # 1 MB buffers so bursts of rows coalesce into fewer OS writes
+    with open(CSV_EXPORT_FILE, "w", newline='', encoding="utf-8", buffering=1 << 20) as cf, \
+         open(JSONL_EXPORT_FILE, "w", encoding="utf-8", buffering=1 << 20) as jf:
+        writer = csv.DictWriter(cf, fieldnames=EXPORT_FIELDS)
         writer.writeheader()
-        for row in password_data:
-            writer.writerow(row)
 
-    print("[✓] Export complete: itglue_passwords.csv and .json")
+        done = False
+        while not done:
+            # Block for one row, then drain whatever else is already queued
+            # so bursts go through writerows in a single batch
+            batch = [await row_queue.get()]
+            while not row_queue.empty():
+                batch.append(row_queue.get_nowait())
+
+            # The None sentinel is always the last item put on the queue
+            if batch[-1] is None:
+                done = True
+                batch.pop()
+
+            if batch:
+                writer.writerows(batch)
+                jf.writelines(json.dumps(row) + "\n" for row in batch)
+                rows_written += len(batch)
+
+    if rows_written:
+        print(f"[✓] Export complete: {rows_written} rows → {CSV_EXPORT_FILE} and {JSONL_EXPORT_FILE}")
+    else:
+        print("[!] No passwords with folders found.")
+    return rows_written
 
 # === Main execution flow ===
-def main():
+async def main():
     start_time = time.time()
     orgs_processed = 0
-    password_data = []
     resolver = FolderResolver()
-
-    # === DEBUG MODE: process only a single org ===
-    if DEBUG_ORG_ID:
-        org_id = DEBUG_ORG_ID
-        print(f"[~] DEBUG_ORG_ID detected: {org_id}")
-        org_resp = safe_get(f"{API_BASE}/organizations/{org_id}", headers=HEADERS)
-
-        org_data = org_resp.json().get("data", {})
-        org_name = org_data.get("attributes", {}).get("name", "Unknown")
-        print(f"[+] Using test organization: {org_name} (ID: {org_id})")
-
-        password_data = process_org_passwords(org_id, org_name, resolver)
-        export_password_data(password_data)
-        return
-
-    # === FULL RUN: process all unprocessed orgs ===
-    org_cache = get_all_organizations()
-
-    # If DEBUG_ORG_COUNT is set, slice the orgs to only include the first X unprocessed
-    if DEBUG_ORG_COUNT is not None:
-        print(f"[~] DEBUG_ORG_COUNT active: limiting to first {DEBUG_ORG_COUNT} unprocessed orgs")
-        unprocessed_items = [(org_id, org_info) for org_id, org_info in org_cache.items() if not org_info.get("Processed")]
-        org_cache = dict(unprocessed_items[:DEBUG_ORG_COUNT])
-
-    total = len(org_cache)
-    completed = sum(1 for o in org_cache.values() if o.get("Processed"))
-    print(f"[*] Starting audit for {total} organizations ({completed} already completed)")
-
-    for idx, (org_id, org_info) in enumerate(org_cache.items(), start=1):
-        if org_info.get("Processed"):
-            continue
-
-        org_name = org_info["OrgName"]
-        print(f"\n[{idx}/{total}] Processing: {org_name} (ID: {org_id})")
-
-        try:
-            org_passwords = process_org_passwords(org_id, org_name, resolver)
-            password_data.extend(org_passwords)
-
-            org_cache[org_id]["Processed"] = True
-            save_org_cache(org_cache)
-            orgs_processed += 1
-
-        except Exception as e:
-            print(f"[!] Fatal error processing {org_name} (ID: {org_id}): {e}")
-            print("[*] Saving progress before exit...")
-            save_org_cache(org_cache)
-            resolver.close()
-            exit(1)
-
-    export_password_data(password_data)
+    password_cache = load_password_cache()
+
+    try:
+        # Single-consumer pipeline: workers put rows, export_writer drains them
+        row_queue = asyncio.Queue()
+        writer_task = asyncio.create_task(export_writer(row_queue))
+
+        async with aiohttp.ClientSession(headers=HEADERS) as session:
+
+            # === DEBUG MODE: process only a single org ===
+            if DEBUG_ORG_ID:
+                org_id = DEBUG_ORG_ID
+                print(f"[~] DEBUG_ORG_ID detected: {org_id}")
+                org_payload = await safe_get(session, ORG_URL(org_id))
+
+                org_data = org_payload.get("data", {})
+                org_name = org_data.get("attributes", {}).get("name", "Unknown")
+                print(f"[+] Using test organization: {org_name} (ID: {org_id})")
+
+                await process_org_passwords(session, org_id, org_name, resolver, row_queue, password_cache)
+                save_password_cache(password_cache)
+                await row_queue.put(None)
+                await writer_task
+                return
+
+            # === FULL RUN: process all unprocessed orgs ===
+            org_cache = await get_all_organizations(session)
+
+            # If DEBUG_ORG_COUNT is set, slice the orgs to only include the first X unprocessed
+            if DEBUG_ORG_COUNT is not None:
+                print(f"[~] DEBUG_ORG_COUNT active: limiting to first {DEBUG_ORG_COUNT} unprocessed orgs")
+                unprocessed_items = [(org_id, org_info) for org_id, org_info in org_cache.items() if not org_info.get("Processed")]
+                org_cache = dict(unprocessed_items[:DEBUG_ORG_COUNT])
+
+            total = len(org_cache)
+            completed = sum(1 for o in org_cache.values() if o.get("Processed"))
+            print(f"[*] Starting audit for {total} organizations ({completed} already completed)")
+
+            unprocessed = {oid: info for oid, info in org_cache.items() if not info.get("Processed")}
+
+            # Completions funnel through one queue so a single task owns the
+            # org_cache file — workers never write it concurrently
+            done_queue = asyncio.Queue()
+
+            async def progress_writer():
+                while True:
+                    done_org_id = await done_queue.get()
+                    if done_org_id is None:
+                        break
+                    org_cache[done_org_id]["Processed"] = True
+                    save_org_cache(org_cache)
+
+            async def run_org(org_id, org_info):
+                org_name = org_info["OrgName"]
+                print(f"\n[*] Processing: {org_name} (ID: {org_id})")
+                await process_org_passwords(session, org_id, org_name, resolver, row_queue, password_cache)
+                await done_queue.put(org_id)
+
+            # ITGlue rate-limits per token, not per org, so orgs can run
+            # concurrently — safe_get's semaphore and token bucket still apply
+            progress_task = asyncio.create_task(progress_writer())
+            results = await asyncio.gather(
+                *[run_org(oid, info) for oid, info in unprocessed.items()],
+                return_exceptions=True
+            )
+            await done_queue.put(None)
+            await progress_task
+            save_password_cache(password_cache)
+
+            for (org_id, org_info), result in zip(unprocessed.items(), results):
+                if isinstance(result, Exception):
+                    print(f"[!] Error processing {org_info['OrgName']} (ID: {org_id}): {result}")
+                else:
+                    orgs_processed += 1
+
+        # Signal the writer that no more rows are coming and let it finish
+        await row_queue.put(None)
+        await writer_task
+    finally:
+        # Always flush the folder cache and shut the headless browser down
+        resolver.close()
 
     # === Final audit summary ===
     end_time = time.time()
@@ -246,4 +417,4 @@ def main():
     print(f"Total execution time:       {elapsed:.1f} seconds")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -2,6 +2,8 @@ import requests
 import json
 import os
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Load API key from .env file
 load_dotenv()
@@ -17,6 +19,18 @@ headers = {
     "Content-Type": "application/vnd.api+json"
 }
 
+# One pooled session for every request: keep-alive avoids a fresh TCP/TLS
+# handshake per call, and urllib3 retries transient failures for us
+session = requests.Session()
+session.headers.update(headers)
+adapter = HTTPAdapter(
+    pool_connections=64,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504])
+)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+
 
 # Get all organizations
 all_orgs = []
@@ -25,41 +39,43 @@ page = 1
 while True:
     print(f"📥 Fetching page {page}...")
     url = f"https://api.itglue.com/organizations?page[size]=1000&page[number]={page}"
-    response = requests.get(url, headers=headers)
+    response = session.get(url)
 
     if response.status_code != 200:
         print(f"❌ Failed to fetch page {page}: {response.status_code}")
         print(response.text)
         break
 
-    data = response.json().get("data", [])
-    if not data:
+    # Parse the body once per page and reuse it
+    payload = response.json()
+    all_orgs.extend(payload.get("data", []))
+
+    # Stop when the API reports no next page
+    if not payload.get("links", {}).get("next"):
         break
 
-    all_orgs.extend(data)
     page += 1
 
+# Delete orgs in batches — one request per BATCH_SIZE ids instead of one per org
+BATCH_SIZE = 50
 
-if response.status_code != 200:
-    print(f"❌ Failed to fetch organizations: {response.status_code}")
-    print(response.text)
-    exit(1)
-
-orgs = response.json().get("data", [])
-
-# Loop and delete each org
-for org in all_orgs:
-    org_id = org["id"]
-    org_name = org["attributes"].get("name", "(Unnamed Org)")
+for start in range(0, len(all_orgs), BATCH_SIZE):
+    batch = all_orgs[start:start + BATCH_SIZE]
+    ids = [str(org["id"]) for org in batch]
 
-    print(f"\n🔻 Deleting organization: {org_name} (ID: {org_id})")
+    print(f"\n🔻 Deleting {len(batch)} organizations (batch {start // BATCH_SIZE + 1})")
 
-    delete_url = f"https://api.itglue.com/organizations?filter[id]={org_id}"
+    delete_url = f"https://api.itglue.com/organizations?filter[id]={','.join(ids)}"
+    delete_response = session.delete(delete_url)
 
-    delete_response = requests.delete(delete_url, headers=headers)
+    # Fall back to the bulk-destroy body form if the filter variant is rejected
+    if delete_response.status_code not in (200, 204):
+        payload = {"data": [{"type": "organizations", "id": org_id} for org_id in ids]}
+        delete_response = session.delete("https://api.itglue.com/organizations", json=payload)
 
     if delete_response.status_code in (200, 204):
-        print(f"🗑️ Successfully deleted: {org_name}")
+        for org in batch:
+            print(f"🗑️ Successfully deleted: {org['attributes'].get('name', '(Unnamed Org)')}")
     else:
-        print(f"❌ Failed to delete {org_name} (ID: {org_id})")
+        print(f"❌ Failed to delete batch (IDs: {', '.join(ids)})")
         print(f"   {delete_response.status_code}: {delete_response.text}")
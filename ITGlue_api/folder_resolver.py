@@ -1,7 +1,12 @@
 import os
 import json
+import asyncio
+import threading
+import orjson
 import pyotp
+import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
@@ -15,15 +20,29 @@ PASSWORD = os.getenv("ITGLUE_PASSWORD")
 TOTP_SECRET = os.getenv("ITGLUE_TOTP_SECRET")
 UI_BASE = os.getenv("ITGLUE_UI_BASE")
 
+# === Prebuilt URL templates — formatted once here, filled in per call ===
+FOLDER_API_URL = f"{UI_BASE}/api/organizations/{{}}/password_folders/{{}}".format
+FOLDER_PAGE_URL = f"{UI_BASE}/{{}}/passwords/folder/{{}}".format
+
 CACHE_FILE = "folder_cache.json"
+CACHE_SAVE_INTERVAL = 10   # Flush the cache to disk every N new resolutions
+FOLDER_CONCURRENCY = 32    # Folder lookups get their own budget, separate from password fetches
 
 class FolderResolver:
     def __init__(self):
-        # Load cache and launch browser session
+        # Load cache, launch browser for the MFA login, then hand the
+        # authenticated cookies to a plain HTTP session for the lookups
         self.cache = self._load_cache()
+        self._unsaved = 0   # Resolutions added since the last disk flush
+        self._cache_lock = threading.Lock()    # Guards cache writes from worker threads
+        self._browser_lock = threading.Lock()  # The shared driver is not thread-safe
+        self._folder_sem = asyncio.Semaphore(FOLDER_CONCURRENCY)
+        self._inflight = {}  # folder_id → Future shared by concurrent callers
         self.driver = self._start_browser()
         self._login()
-    
+        self._install_breadcrumb_helper()
+        self.session = self._build_http_session()
+
     # === Load cached folder data from disk (if available) ===
     def _load_cache(self):
         if os.path.exists(CACHE_FILE):
@@ -34,11 +53,17 @@ class FolderResolver:
                 print(f"[!] Failed to load cache file: {e}")
         return {}
 
-    # === Save cache to disk on exit ===
+    # === Save cache to disk (compact form — these writes happen mid-run) ===
+    # Serialized behind the cache lock and swapped in atomically, so worker
+    # threads flushing at the same time can't interleave and corrupt the file
     def _save_cache(self):
         try:
-            with open(CACHE_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.cache, f, indent=2)
+            with self._cache_lock:
+                tmp_file = CACHE_FILE + ".tmp"
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    json.dump(self.cache, f, separators=(',', ':'))
+                os.replace(tmp_file, CACHE_FILE)
+                self._unsaved = 0
         except Exception as e:
             print(f"[!] Failed to write cache file: {e}")
 
@@ -70,42 +95,162 @@ class FolderResolver:
         # Step 3: wait for dashboard element to confirm login
         WebDriverWait(self.driver, 10).until(EC.presence_of_element_located((By.ID, "react-main")))
 
+    # === Install the breadcrumb reader once, on every page the browser loads ===
+    def _install_breadcrumb_helper(self):
+        # Page.addScriptToEvaluateOnNewDocument survives navigation (a one-off
+        # Runtime.evaluate would be wiped by the next driver.get), so the
+        # helper is compiled once per page instead of shipped with every call
+        self.driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
+            "source": (
+                "window.__getBreadcrumbs = function () {"
+                "  var items = document.querySelectorAll('ul.breadcrumb li');"
+                "  if (!items.length) return null;"
+                "  var last = items[items.length - 1].querySelector('a');"
+                "  if (!last || last.href.indexOf('/folder/') === -1) return null;"
+                "  return Array.from(items).map(function (li) { return li.innerText.trim(); });"
+                "};"
+            )
+        })
+
+    # === Copy the authenticated browser cookies into a requests session ===
+    def _build_http_session(self):
+        session = requests.Session()
+
+        # Size the connection pool to the lookup concurrency — the default
+        # pool of 10 would churn connections under 32 parallel workers
+        adapter = HTTPAdapter(pool_connections=FOLDER_CONCURRENCY, pool_maxsize=FOLDER_CONCURRENCY)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        for cookie in self.driver.get_cookies():
+            session.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain"))
+        session.headers["Accept"] = "application/json"
+
+        # Some UI endpoints validate the CSRF token; lift it from the page once
+        token = self.driver.execute_script(
+            "var m = document.querySelector('meta[name=\"csrf-token\"]'); return m ? m.content : null;"
+        )
+        if token:
+            session.headers["X-CSRF-Token"] = token
+
+        return session
+
     # === Resolve folder name and parent name from folder ID (with caching) ===
-    def resolve(self, org_id, folder_id):
+    async def resolve(self, org_id, folder_id):
         # Return cached value if available
         if folder_id in self.cache:
             return self.cache[folder_id]
 
+        # If another task is already resolving this folder, share its result
+        # instead of issuing a duplicate request
+        pending = self._inflight.get(folder_id)
+        if pending is not None:
+            return await pending
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[folder_id] = future
+
         try:
-            url = f"{UI_BASE}/{org_id}/passwords/folder/{folder_id}"
-            self.driver.get(url)
-
-            # Wait for breadcrumb navigation to fully load
-            WebDriverWait(self.driver, 10).until(
-                lambda d: "/folder/" in d.find_element(
-                    By.XPATH, "//ul[contains(@class,'breadcrumb')]/li[last()]/a"
-                ).get_attribute("href")
-            )
+            # Lookups run under their own semaphore so they don't compete
+            # with the password fetches for concurrency slots
+            async with self._folder_sem:
+                resolved = await asyncio.to_thread(self._resolve_sync, org_id, folder_id)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(folder_id, None)
+
+        future.set_result(resolved)
+        return resolved
+
+    # === Blocking lookup body, run in a worker thread by resolve() ===
+    def _resolve_sync(self, org_id, folder_id):
+        # Prefer the UI's JSON endpoint — one HTTP call instead of a page render
+        resolved = self._resolve_via_http(org_id, folder_id)
+
+        # Fall back to scraping the breadcrumbs if the endpoint misbehaves.
+        # Only one worker may drive the shared browser at a time — concurrent
+        # driver.get calls would read each other's breadcrumbs
+        if resolved is None:
+            with self._browser_lock:
+                resolved = self._resolve_via_browser(org_id, folder_id)
+
+        if resolved is None:
+            return {"FolderName": None, "ParentFolderName": None}
+
+        # Periodically flush the cache so a crash loses at most a few entries;
+        # the counter is bumped under the lock since worker threads share it
+        with self._cache_lock:
+            self.cache[folder_id] = resolved
+            self._unsaved += 1
+            flush = self._unsaved >= CACHE_SAVE_INTERVAL
+        if flush:
+            self._save_cache()
 
-            # Parse breadcrumb elements
-            breadcrumbs = self.driver.find_elements(By.XPATH, "//ul[contains(@class,'breadcrumb')]/li")
-            folder_name = breadcrumbs[-1].text.strip() if len(breadcrumbs) >= 1 else None
-            parent_name = breadcrumbs[-2].text.strip() if len(breadcrumbs) >= 2 else "root"
+        return resolved
+
+    # === Fetch one folder record from the UI's internal JSON endpoint ===
+    def _get_folder_json(self, org_id, folder_id):
+        response = self.session.get(FOLDER_API_URL(org_id, folder_id), timeout=15)
+        response.raise_for_status()
+        payload = orjson.loads(response.content)
+        return payload.get("data", payload)
+
+    # === Resolve via authenticated HTTP (no browser involved) ===
+    def _resolve_via_http(self, org_id, folder_id):
+        try:
+            folder = self._get_folder_json(org_id, folder_id)
+            folder_name = folder.get("name")
+            if not folder_name:
+                return None
+
+            # Look up the parent folder's name if there is one, reusing the
+            # cache so an already-resolved parent costs no extra request
+            parent_id = folder.get("parent_id")
+            if not parent_id:
+                parent_name = "root"
+            elif str(parent_id) in self.cache:
+                parent_name = self.cache[str(parent_id)].get("FolderName") or "root"
+            else:
+                parent_name = self._get_folder_json(org_id, parent_id).get("name") or "root"
+
+            return {
+                "FolderName": folder_name,
+                "ParentFolderName": parent_name
+            }
+
+        except Exception as e:
+            print(f"[!] HTTP folder lookup failed for {folder_id}: {e}")
+            return None
+
+    # === Resolve by loading the folder page and reading the breadcrumbs ===
+    def _resolve_via_browser(self, org_id, folder_id):
+        try:
+            self.driver.get(FOLDER_PAGE_URL(org_id, folder_id))
+
+            # Poll the pre-installed helper — one tiny JS-bridge call per
+            # attempt, no WebElement marshalling and no script re-upload
+            breadcrumbs = WebDriverWait(self.driver, 10).until(
+                lambda d: d.execute_script(
+                    "return window.__getBreadcrumbs && window.__getBreadcrumbs();"
+                )
+            )
+            folder_name = breadcrumbs[-1] if len(breadcrumbs) >= 1 else None
+            parent_name = breadcrumbs[-2] if len(breadcrumbs) >= 2 else "root"
 
             # Normalize "Passwords" as root folder
             if parent_name.lower() == "passwords":
                 parent_name = "root"
 
-            # Store in memory cache and return
-            self.cache[folder_id] = {
+            return {
                 "FolderName": folder_name,
                 "ParentFolderName": parent_name
             }
-            return self.cache[folder_id]
 
         except Exception as e:
             print(f"[!] Failed to resolve folder ID {folder_id}: {e}")
-            return {"FolderName": None, "ParentFolderName": None}
+            return None
 
     # === Save cache and close browser cleanly ===
     def close(self):